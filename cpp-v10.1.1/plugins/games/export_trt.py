@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Export the Ganglion Brain for deployment inference.
+
+- Exports GanglionBrain to ONNX with fixed batch=1 shapes:
+    board_planes [1,12,8,8], history_seq [1,MAX_HISTORY,4],
+    ca_state [1,4,8,8], history_len [1]
+- Optionally builds an FP16 TensorRT engine (.plan) from it.
+
+The plan is loaded by neural_chess_ganlgion.py via --engine brain.plan
+(human mode only; its weights are frozen).
+
+Note: nothing in this repo saves GanglionBrain weights yet. Without
+--weights the exported brain is freshly initialized (untrained); --weights
+expects a GanglionBrain state_dict you saved yourself.
+
+Without the tensorrt Python package, build it with:
+    trtexec --onnx=brain.onnx --fp16 --saveEngine=brain.plan
+"""
+
+import argparse
+
+import torch
+
+from neural_chess_ganlgion import (
+    BOARD_SIZE,
+    MAX_HISTORY,
+    NUM_PIECE_PLANES,
+    TRT_INPUT_NAMES,
+    TRT_OUTPUT_NAMES,
+    GanglionBrain,
+)
+
+
+def export_onnx(brain: GanglionBrain, onnx_path: str) -> None:
+    # Exported on CPU so CA2D takes the plain PyTorch path (no Triton op).
+    brain = brain.cpu().eval()
+    args = (
+        torch.zeros(1, NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE),
+        torch.zeros(1, MAX_HISTORY, 4),
+        torch.zeros(1, 4, BOARD_SIZE, BOARD_SIZE),
+        torch.ones(1, dtype=torch.long),
+    )
+    with torch.no_grad():
+        torch.onnx.export(brain, args, onnx_path,
+                          input_names=list(TRT_INPUT_NAMES),
+                          output_names=list(TRT_OUTPUT_NAMES),
+                          opset_version=18,
+                          external_data=False)
+    print(f"[export] Wrote {onnx_path}")
+
+
+def build_engine(onnx_path: str, plan_path: str, fp16: bool = True) -> None:
+    import tensorrt as trt
+
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(0)
+    parser = trt.OnnxParser(network, logger)
+    with open(onnx_path, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError("ONNX parse failed:\n" + "\n".join(errors))
+
+    config = builder.create_builder_config()
+    if fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError("TensorRT engine build failed")
+    with open(plan_path, "wb") as f:
+        f.write(serialized)
+    print(f"[export] Wrote {plan_path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export Ganglion Brain to ONNX / TensorRT")
+    parser.add_argument("--weights",
+                        default=None,
+                        help="GanglionBrain state_dict to load before export (not saved by "
+                             "this repo; without it the export is untrained).")
+    parser.add_argument("--onnx",
+                        default="brain.onnx",
+                        help="Output ONNX path.")
+    parser.add_argument("--plan",
+                        default=None,
+                        help="If set, also build a TensorRT engine at this path.")
+    parser.add_argument("--no-fp16",
+                        action="store_true",
+                        help="Build the TensorRT engine in FP32.")
+
+    args = parser.parse_args()
+
+    brain = GanglionBrain()
+    if args.weights:
+        brain.load_state_dict(torch.load(args.weights, map_location="cpu"))
+
+    export_onnx(brain, args.onnx)
+    if args.plan:
+        build_engine(args.onnx, args.plan, fp16=not args.no_fp16)
+
+
+if __name__ == "__main__":
+    main()
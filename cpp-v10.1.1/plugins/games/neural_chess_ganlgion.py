@@ -6,7 +6,7 @@ Neural Chess "Ganglion Brain" – Claude-style homage.
 - "Brain" is a synchronized trio of:
     * CNN over board planes
     * GRU over move history
-    * LSTM over a Cellular Automaton (CA) grid
+    * Attention over a Cellular Automaton (CA) grid
   coordinated by a "Ganglion" module.
 - GAN-style pair:
     * Generator: GanglionBrain (policy + value)
@@ -20,15 +20,23 @@ Supports:
 import argparse
 import math
 import random
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.nn.utils.rnn import pad_sequence
 import chess
 
+try:
+    import triton
+    import triton.language as tl
+except ImportError:  # optional: only used for the fused CA2D kernel on CUDA
+    triton = None
+
 
 # ===================== Utility / Encoding ============================
 
@@ -36,49 +44,36 @@ NUM_PIECE_PLANES = 12  # 6 white + 6 black
 BOARD_SIZE = 8
 MAX_HISTORY = 32
 POLICY_DIM = BOARD_SIZE * BOARD_SIZE * BOARD_SIZE * BOARD_SIZE  # 64*64
+LEGAL_CACHE_SIZE = 4096  # positions kept in the engine's legal-move LRU
+
+# (legal moves, (from,to) -> move lookup, policy indices [N] int64)
+LegalEntry = Tuple[List[chess.Move], Dict[Tuple[int, int], chess.Move], np.ndarray]
+
 
+# (piece_type, color) for each plane, in plane order.
+PLANE_PIECES = tuple(
+    (piece_type, color)
+    for color in (chess.WHITE, chess.BLACK)
+    for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP,
+                       chess.ROOK, chess.QUEEN, chess.KING)
+)
 
-def board_to_planes(board: chess.Board) -> torch.Tensor:
+
+def board_to_planes(board: chess.Board, out: Optional[np.ndarray] = None) -> torch.Tensor:
     """
     Encode board to [12, 8, 8] planes:
       0..5: white P,N,B,R,Q,K
       6..11: black p,n,b,r,q,k
+
+    Unpacks the 12 piece bitboards in one shot (bit i == square i == rank*8+file).
+    If `out` is given (float32 [12,8,8]) it is filled in place and reused.
     """
-    planes = np.zeros((NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE), dtype=np.float32)
-    piece_map = board.piece_map()
-    for sq, piece in piece_map.items():
-        rank = chess.square_rank(sq)
-        file = chess.square_file(sq)
-        idx = None
-        if piece.color == chess.WHITE:
-            if piece.piece_type == chess.PAWN:
-                idx = 0
-            elif piece.piece_type == chess.KNIGHT:
-                idx = 1
-            elif piece.piece_type == chess.BISHOP:
-                idx = 2
-            elif piece.piece_type == chess.ROOK:
-                idx = 3
-            elif piece.piece_type == chess.QUEEN:
-                idx = 4
-            elif piece.piece_type == chess.KING:
-                idx = 5
-        else:
-            if piece.piece_type == chess.PAWN:
-                idx = 6
-            elif piece.piece_type == chess.KNIGHT:
-                idx = 7
-            elif piece.piece_type == chess.BISHOP:
-                idx = 8
-            elif piece.piece_type == chess.ROOK:
-                idx = 9
-            elif piece.piece_type == chess.QUEEN:
-                idx = 10
-            elif piece.piece_type == chess.KING:
-                idx = 11
-        if idx is not None:
-            planes[idx, rank, file] = 1.0
-    return torch.from_numpy(planes)
+    masks = np.array([board.pieces_mask(pt, color) for pt, color in PLANE_PIECES], dtype="<u8")
+    bits = np.unpackbits(masks.view(np.uint8), bitorder="little")
+    if out is None:
+        out = np.empty((NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE), dtype=np.float32)
+    out[...] = bits.reshape(NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE)
+    return torch.from_numpy(out)
 
 
 def encode_move_to_index(move: chess.Move) -> int:
@@ -89,45 +84,124 @@ def encode_move_to_index(move: chess.Move) -> int:
     return move.from_square * 64 + move.to_square
 
 
-def index_to_move(board: chess.Board, idx: int) -> Optional[chess.Move]:
+def encode_moves_to_indices(moves: List[chess.Move]) -> np.ndarray:
     """
-    Map index back to a legal move (if any). If multiple promotions share same
-    from/to, prefer queen promotion.
+    Vectorized encode_move_to_index: returns int64 array [N].
     """
-    from_sq = idx // 64
-    to_sq = idx % 64
-    candidates = [m for m in board.legal_moves if m.from_square == from_sq and m.to_square == to_sq]
-    if not candidates:
-        return None
-    # Prefer queen promotion if available, else first legal
-    for m in candidates:
-        if m.promotion == chess.QUEEN:
-            return m
-    return candidates[0]
-
-
-def encode_history(moves: List[chess.Move], max_len: int = MAX_HISTORY) -> torch.Tensor:
+    return np.fromiter((m.from_square * 64 + m.to_square for m in moves),
+                       dtype=np.int64, count=len(moves))
+
+
+def legal_move_lookup(moves: List[chess.Move]) -> Dict[Tuple[int, int], chess.Move]:
+    """
+    Map (from_sq, to_sq) -> move. If multiple promotions share the same
+    from/to, prefer queen promotion, else the first legal move.
+    """
+    lookup: Dict[Tuple[int, int], chess.Move] = {}
+    for m in moves:
+        key = (m.from_square, m.to_square)
+        if key not in lookup or m.promotion == chess.QUEEN:
+            lookup[key] = m
+    return lookup
+
+
+def encode_history(moves: List[chess.Move],
+                   max_len: int = MAX_HISTORY,
+                   out: Optional[np.ndarray] = None) -> torch.Tensor:
     """
     Encode move history as sequence [T, 4]:
       [from/63, to/63, is_promotion, promotion_type/6]
+
+    If `out` is given (float32 [>=max_len,4]) its first T rows are filled and
+    a view of them is returned.
     """
-    seq = []
     last_moves = moves[-max_len:]
-    for m in last_moves:
-        from_norm = m.from_square / 63.0
-        to_norm = m.to_square / 63.0
-        is_promo = 1.0 if m.promotion is not None else 0.0
-        promo_type = (m.promotion or 0) / 6.0  # piece_type in 1..6
-        seq.append([from_norm, to_norm, is_promo, promo_type])
-    if not seq:
+    T = len(last_moves)
+    if T == 0:
         # at least one zero vector to keep GRU shapes valid
-        seq = [[0.0, 0.0, 0.0, 0.0]]
-    arr = np.array(seq, dtype=np.float32)
+        if out is None:
+            return torch.zeros(1, 4)
+        out[:1] = 0.0
+        return torch.from_numpy(out[:1])
+    fs = np.fromiter((m.from_square for m in last_moves), dtype=np.float32, count=T)
+    ts = np.fromiter((m.to_square for m in last_moves), dtype=np.float32, count=T)
+    pr = np.fromiter((m.promotion or 0 for m in last_moves), dtype=np.float32, count=T)  # 1..6
+    arr = np.empty((T, 4), dtype=np.float32) if out is None else out[:T]
+    arr[:, 0] = fs / 63.0
+    arr[:, 1] = ts / 63.0
+    arr[:, 2] = pr > 0
+    arr[:, 3] = pr / 6.0
     return torch.from_numpy(arr)  # [T,4]
 
 
 # ===================== Cellular Automaton ============================
 
+# The fused CA2D op needs triton and torch.library.custom_op (torch >= 2.4).
+HAS_FUSED_CA2D = triton is not None and hasattr(torch.library, "custom_op")
+
+if HAS_FUSED_CA2D:
+    @triton.jit
+    def _ca2d_fused_kernel(state_ptr, planes_ptr, w_ptr, b_ptr, out_ptr,
+                           s_sb, s_sc, s_sh, s_sw,
+                           p_sb, p_sc, p_sh, p_sw,
+                           o_sb, o_sc, o_sh, o_sw,
+                           C: tl.constexpr, P: tl.constexpr, N: tl.constexpr):
+        """
+        One program per (batch, out channel): 3x3 conv over [state, planes]
+        without materializing the concat, then tanh and residual add.
+        """
+        b = tl.program_id(0)
+        co = tl.program_id(1)
+        offs = tl.arange(0, N * N)
+        row = offs // N
+        col = offs % N
+
+        acc = tl.zeros([N * N], dtype=tl.float32) + tl.load(b_ptr + co).to(tl.float32)
+        for kh in tl.static_range(3):
+            for kw in tl.static_range(3):
+                r = row + (kh - 1)
+                c = col + (kw - 1)
+                valid = (r >= 0) & (r < N) & (c >= 0) & (c < N)
+                for ci in tl.static_range(C):
+                    x = tl.load(state_ptr + b * s_sb + ci * s_sc + r * s_sh + c * s_sw,
+                                mask=valid, other=0.0)
+                    wv = tl.load(w_ptr + ((co * (C + P) + ci) * 3 + kh) * 3 + kw)
+                    acc += x.to(tl.float32) * wv.to(tl.float32)
+                for ci in tl.static_range(P):
+                    x = tl.load(planes_ptr + b * p_sb + ci * p_sc + r * p_sh + c * p_sw,
+                                mask=valid, other=0.0)
+                    wv = tl.load(w_ptr + ((co * (C + P) + C + ci) * 3 + kh) * 3 + kw)
+                    acc += x.to(tl.float32) * wv.to(tl.float32)
+
+        delta = 2.0 * tl.sigmoid(2.0 * acc) - 1.0  # tanh
+        res = tl.load(state_ptr + b * s_sb + co * s_sc + row * s_sh + col * s_sw)
+        out = res.to(tl.float32) + delta
+        tl.store(out_ptr + b * o_sb + co * o_sc + row * o_sh + col * o_sw,
+                 out.to(out_ptr.dtype.element_ty))
+
+    @torch.library.custom_op("woflang::ca2d_fused", mutates_args=())
+    def ca2d_fused(state: torch.Tensor,
+                   board_planes: torch.Tensor,
+                   weight: torch.Tensor,
+                   bias: torch.Tensor) -> torch.Tensor:
+        """
+        Inference-only fused CA2D step: state + tanh(conv3x3(cat(state, planes))).
+        """
+        B, C, H, W = state.shape
+        out = torch.empty_like(state)
+        weight = weight.contiguous()
+        _ca2d_fused_kernel[(B, C)](
+            state, board_planes, weight, bias, out,
+            *state.stride(), *board_planes.stride(), *out.stride(),
+            C=C, P=board_planes.size(1), N=H,
+        )
+        return out
+
+    @ca2d_fused.register_fake
+    def _(state, board_planes, weight, bias):
+        return torch.empty_like(state)
+
+
 class CA2D(nn.Module):
     """
     Simple differentiable 2D cellular automaton.
@@ -152,6 +226,8 @@ class CA2D(nn.Module):
         state: [B,C,8,8], board_planes: [B,12,8,8]
         returns: new_state [B,C,8,8]
         """
+        if HAS_FUSED_CA2D and state.is_cuda and not torch.is_grad_enabled():
+            return torch.ops.woflang.ca2d_fused(state, board_planes, self.conv.weight, self.conv.bias)
         x = torch.cat([state, board_planes], dim=1)
         delta = torch.tanh(self.conv(x))
         return state + delta
@@ -170,12 +246,12 @@ class BoardCNN(nn.Module):
             nn.Conv2d(64, 64, kernel_size=3, padding=1),
             nn.ReLU(inplace=True),
         )
-        self.fc = nn.Linear(64 * BOARD_SIZE * BOARD_SIZE, out_dim)
+        self.fc = nn.Linear(64, out_dim)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         # x: [B,12,8,8]
         h = self.conv(x)
-        h = h.view(h.size(0), -1)
+        h = nn.functional.adaptive_avg_pool2d(h, 1).flatten(1)  # [B,64]
         return torch.tanh(self.fc(h))
 
 
@@ -184,27 +260,39 @@ class HistoryRNN(nn.Module):
         super().__init__()
         self.gru = nn.GRU(input_dim, hidden_dim, batch_first=True)
 
-    def forward(self, seq: torch.Tensor) -> torch.Tensor:
-        # seq: [B,T,4]
-        _, h_n = self.gru(seq)
-        # h_n: [1,B,H]
-        return torch.tanh(h_n.squeeze(0))
+    def forward(self, seq: torch.Tensor, lengths: Optional[torch.Tensor] = None) -> torch.Tensor:
+        # seq: [B,T,4]; lengths: optional [B] valid steps of a right-padded seq
+        out, h_n = self.gru(seq)
+        if lengths is None:
+            # h_n: [1,B,H]
+            return torch.tanh(h_n.squeeze(0))
+        # Output at the last valid step == final hidden state of the unpadded seq.
+        last = (lengths - 1).view(-1, 1, 1).expand(-1, 1, out.size(2))
+        return torch.tanh(out.gather(1, last).squeeze(1))
 
 
-class ContextLSTM(nn.Module):
-    def __init__(self, input_dim: int, hidden_dim: int = 64):
+class ContextEncoder(nn.Module):
+    def __init__(self, input_dim: int, hidden_dim: int = 64, num_heads: int = 4):
         super().__init__()
-        self.lstm = nn.LSTM(input_dim, hidden_dim, batch_first=True)
+        self.proj = nn.Linear(input_dim, hidden_dim)
+        self.pos = nn.Parameter(torch.zeros(1, BOARD_SIZE * BOARD_SIZE, hidden_dim))
+        self.cls = nn.Parameter(torch.zeros(1, 1, hidden_dim))
+        nn.init.normal_(self.pos, std=0.02)
+        nn.init.normal_(self.cls, std=0.02)
+        self.attn = nn.MultiheadAttention(hidden_dim, num_heads, batch_first=True)
 
     def forward(self, ca_state: torch.Tensor) -> torch.Tensor:
         """
         ca_state: [B,C,8,8]
-        Treat spatial positions as sequence of length 64 with C features.
+        Treat spatial positions as 64 tokens with C features; a learned cls
+        token attends over all of them in one parallel pass.
         """
         B, C, H, W = ca_state.shape
-        seq = ca_state.view(B, C, H * W).permute(0, 2, 1)  # [B,64,C]
-        _, (h_n, _) = self.lstm(seq)
-        return torch.tanh(h_n.squeeze(0))
+        seq = ca_state.reshape(B, C, H * W).permute(0, 2, 1)  # [B,64,C]
+        tokens = self.proj(seq) + self.pos  # [B,64,D]
+        query = self.cls.expand(B, -1, -1)  # [B,1,D]
+        out, _ = self.attn(query, tokens, tokens, need_weights=False)
+        return torch.tanh(out[:, 0])
 
 
 # ===================== Ganglion Brain (Generator) ===================
@@ -214,7 +302,7 @@ class GanglionBrain(nn.Module):
     The "brain" coordinating:
       - Board CNN
       - History GRU
-      - CA-based context LSTM
+      - CA-based context encoder
     """
 
     def __init__(self,
@@ -222,12 +310,14 @@ class GanglionBrain(nn.Module):
                  hist_dim: int = 64,
                  ctx_dim: int = 64,
                  ca_channels: int = 4,
-                 hidden_dim: int = 256):
+                 hidden_dim: int = 256,
+                 board_cnn: Optional[BoardCNN] = None):
         super().__init__()
         self.ca = CA2D(channels=ca_channels)
-        self.board_cnn = BoardCNN(out_dim=board_dim)
+        # May be shared with the discriminator; see NeuralChessEngine.
+        self.board_cnn = board_cnn if board_cnn is not None else BoardCNN(out_dim=board_dim)
         self.hist_rnn = HistoryRNN(hidden_dim=hist_dim)
-        self.ctx_lstm = ContextLSTM(input_dim=ca_channels, hidden_dim=ctx_dim)
+        self.ctx_enc = ContextEncoder(input_dim=ca_channels, hidden_dim=ctx_dim)
 
         fused_dim = board_dim + hist_dim + ctx_dim
         self.fc_shared = nn.Sequential(
@@ -240,11 +330,15 @@ class GanglionBrain(nn.Module):
     def forward(self,
                 board_planes: torch.Tensor,
                 history_seq: torch.Tensor,
-                ca_state: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+                ca_state: torch.Tensor,
+                history_len: Optional[torch.Tensor] = None,
+                board_feat: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         board_planes: [B,12,8,8]
         history_seq:  [B,T,4]
         ca_state:     [B,C,8,8]
+        history_len:  optional [B] valid length if history_seq is right-padded
+        board_feat:   optional precomputed board_cnn(board_planes) [B,board_dim]
 
         returns:
           policy_logits: [B,4096]
@@ -252,9 +346,9 @@ class GanglionBrain(nn.Module):
           new_ca_state:  [B,C,8,8]
         """
         new_ca = self.ca(ca_state, board_planes)
-        b_feat = self.board_cnn(board_planes)
-        h_feat = self.hist_rnn(history_seq)
-        c_feat = self.ctx_lstm(new_ca)
+        b_feat = self.board_cnn(board_planes) if board_feat is None else board_feat
+        h_feat = self.hist_rnn(history_seq, history_len)
+        c_feat = self.ctx_enc(new_ca)
         fused = torch.cat([b_feat, h_feat, c_feat], dim=1)
         x = self.fc_shared(fused)
         policy_logits = self.policy_head(x)
@@ -266,32 +360,95 @@ class GanglionBrain(nn.Module):
 
 class MoveDiscriminator(nn.Module):
     """
-    Simple discriminator: (board_planes, move_index) -> [0,1]
+    Simple discriminator: (board_planes, move_index) -> plausibility logit
     """
 
-    def __init__(self, board_dim: int = 128, move_embed_dim: int = 32, hidden_dim: int = 128):
+    def __init__(self,
+                 board_dim: int = 128,
+                 move_embed_dim: int = 32,
+                 hidden_dim: int = 128,
+                 board_cnn: Optional[BoardCNN] = None):
         super().__init__()
-        self.board_cnn = BoardCNN(out_dim=board_dim)
+        self.board_cnn = board_cnn if board_cnn is not None else BoardCNN(out_dim=board_dim)
         self.move_embed = nn.Embedding(POLICY_DIM, move_embed_dim)
         self.fc = nn.Sequential(
             nn.Linear(board_dim + move_embed_dim, hidden_dim),
             nn.ReLU(inplace=True),
-            nn.Linear(hidden_dim, 1),
-            nn.Sigmoid()
+            nn.Linear(hidden_dim, 1)
         )
 
-    def forward(self, board_planes: torch.Tensor, move_index: torch.Tensor) -> torch.Tensor:
+    def forward(self,
+                board_planes: torch.Tensor,
+                move_index: torch.Tensor,
+                board_feat: Optional[torch.Tensor] = None) -> torch.Tensor:
         """
         board_planes: [B,12,8,8]
         move_index:   [B] (long)
-        returns: [B,1] scores in [0,1]
+        board_feat:   optional precomputed board_cnn(board_planes) [B,board_dim]
+        returns: [B,1] logits (apply torch.sigmoid for a [0,1] score)
         """
-        b_feat = self.board_cnn(board_planes)
+        b_feat = self.board_cnn(board_planes) if board_feat is None else board_feat
         m_emb = self.move_embed(move_index)
         x = torch.cat([b_feat, m_emb], dim=1)
         return self.fc(x)
 
 
+# ===================== TensorRT Inference ===========================
+
+# I/O tensor names shared with export_trt.py
+TRT_INPUT_NAMES = ("board_planes", "history_seq", "ca_state", "history_len")
+TRT_OUTPUT_NAMES = ("policy_logits", "value", "new_ca_state")
+
+
+class TRTBrain:
+    """
+    GanglionBrain inference served by a TensorRT engine built by export_trt.py.
+    Fixed batch=1 shapes; history is right-padded to MAX_HISTORY. Weights are
+    frozen in the plan, so this is for play, not training.
+    """
+
+    def __init__(self, plan_path: str, device: torch.device):
+        import tensorrt as trt
+
+        if device.type != "cuda":
+            raise ValueError("TensorRT engines require a CUDA device")
+        torch_dtypes = {
+            trt.float32: torch.float32,
+            trt.float16: torch.float16,
+            trt.int32: torch.int32,
+            trt.int64: torch.int64,
+        }
+
+        logger = trt.Logger(trt.Logger.WARNING)
+        with open(plan_path, "rb") as f:
+            self.engine = trt.Runtime(logger).deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"Failed to load TensorRT engine: {plan_path}")
+        self.context = self.engine.create_execution_context()
+
+        # Static device buffers bound once to the execution context
+        self.buffers: Dict[str, torch.Tensor] = {}
+        for name in TRT_INPUT_NAMES + TRT_OUTPUT_NAMES:
+            shape = tuple(self.engine.get_tensor_shape(name))
+            dtype = torch_dtypes[self.engine.get_tensor_dtype(name)]
+            self.buffers[name] = torch.zeros(shape, dtype=dtype, device=device)
+            self.context.set_tensor_address(name, self.buffers[name].data_ptr())
+
+    def __call__(self,
+                 planes: torch.Tensor,
+                 hist_seq: torch.Tensor,
+                 ca_state: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        T = hist_seq.size(1)
+        self.buffers["board_planes"].copy_(planes)
+        self.buffers["history_seq"].zero_()
+        self.buffers["history_seq"][:, :T].copy_(hist_seq)
+        self.buffers["history_len"].fill_(T)
+        self.buffers["ca_state"].copy_(ca_state)
+        self.context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+        logits, value, new_ca = (self.buffers[name].clone() for name in TRT_OUTPUT_NAMES)
+        return logits, value, new_ca.float()
+
+
 # ===================== Engine + Training Loop =======================
 
 @dataclass
@@ -308,22 +465,100 @@ class NeuralChessEngine:
       - Training (self-play GAN-ish updates)
     """
 
-    def __init__(self, device: Optional[str] = None):
+    def __init__(self,
+                 device: Optional[str] = None,
+                 compile_models: bool = True,
+                 engine_path: Optional[str] = None):
         if device is None:
             device = "cuda" if torch.cuda.is_available() else "cpu"
         self.device = torch.device(device)
 
-        self.brain = GanglionBrain().to(self.device)
-        self.disc = MoveDiscriminator().to(self.device)
+        # NHWC + TF32 lets cuDNN pick tensor-core conv/matmul kernels on Ampere+.
+        self._memory_format = torch.contiguous_format
+        if self.device.type == "cuda":
+            torch.backends.cudnn.benchmark = True
+            torch.set_float32_matmul_precision("high")
+            self._memory_format = torch.channels_last
+
+        # One BoardCNN shared by generator and discriminator. It is trained by
+        # the generator only; the discriminator sees its features detached.
+        self.board_cnn = BoardCNN(out_dim=128).to(self.device, memory_format=self._memory_format)
+        self.brain = GanglionBrain(board_cnn=self.board_cnn).to(self.device, memory_format=self._memory_format)
+        self.disc = MoveDiscriminator(board_cnn=self.board_cnn).to(self.device, memory_format=self._memory_format)
+        shared = {id(p) for p in self.board_cnn.parameters()}
+        disc_params = [p for p in self.disc.parameters() if id(p) not in shared]
+
+        # Graph-compile the nets. Not "reduce-overhead": select_move already
+        # replays its own CUDA graph, and training batches vary in shape.
+        # Dynamo cannot trace nn.GRU, so the brain graph-breaks at HistoryRNN:
+        # it compiles as the code around the GRU, and the GRU runs eagerly.
+        self._compiled = compile_models and hasattr(torch, "compile")
+        if self._compiled:
+            self.board_cnn = torch.compile(self.board_cnn)
+            self.brain = torch.compile(self.brain)
+            self.disc = torch.compile(self.disc)
 
         self.gen_opt = optim.Adam(self.brain.parameters(), lr=1e-4)
-        self.disc_opt = optim.Adam(self.disc.parameters(), lr=1e-4)
+        self.disc_opt = optim.Adam(disc_params, lr=1e-4)
+
+        # Mixed precision on CUDA: bf16 on Ampere+ (native tensor-core bf16, no
+        # loss scaling needed), otherwise fp16 with a GradScaler. Decided from
+        # this engine's device capability, since is_bf16_supported() also
+        # reports emulated bf16 on older GPUs. CPU stays in fp32.
+        self._amp_enabled = self.device.type == "cuda"
+        self._amp_dtype = torch.bfloat16
+        if self._amp_enabled and torch.cuda.get_device_capability(self.device)[0] < 8:
+            self._amp_dtype = torch.float16
+        self.scaler = torch.amp.GradScaler(self.device.type,
+                                           enabled=self._amp_enabled and self._amp_dtype == torch.float16)
 
         self.board = chess.Board()
         self.history: List[chess.Move] = []
         self.state = BrainState(ca_state=torch.zeros(1, 4, 8, 8, device=self.device))
 
-        self.bce = nn.BCELoss()
+        # LRU of position -> LegalEntry, keyed by the board's transposition
+        # key so repeated positions skip movegen and index encoding.
+        self._legal_cache: "OrderedDict[tuple, LegalEntry]" = OrderedDict()
+
+        self.bce = nn.BCEWithLogitsLoss()
+
+        # [1] move-index buffers refilled in place by train_on_position.
+        self._idx_buf_real = torch.empty(1, dtype=torch.long, device=self.device)
+        self._idx_buf_fake = torch.empty(1, dtype=torch.long, device=self.device)
+
+        # Per-ply legality mask over the policy, refilled in place by select_move.
+        self._legal_mask = torch.zeros(POLICY_DIM, dtype=torch.bool, device=self.device)
+
+        # Self-play training examples: (planes [12,8,8], history [T,4],
+        # ca_state [C,8,8], real_idx, fake_idx), consumed by train_on_batch.
+        self._replay: List[Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]] = []
+
+        # Optional TensorRT plan for select_move; replaces the CUDA graph path.
+        self._trt = TRTBrain(engine_path, self.device) if engine_path else None
+
+        self._graph: Optional[torch.cuda.CUDAGraph] = None
+        if self.device.type == "cuda" and self._trt is None:
+            self._capture_brain_graph()
+
+        # With a TensorRT plan the compiled nets are never called.
+        if self._compiled and self._trt is None:
+            self._warmup()
+
+        # Host-side staging buffers for planes/history, reused every move. On
+        # CUDA they are pinned and copied on a dedicated stream straight into
+        # the captured graph's static inputs (or fixed device buffers if no
+        # graph); on CPU they are the network inputs directly.
+        use_cuda = self.device.type == "cuda"
+        self._planes_buf = torch.zeros(1, NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE, pin_memory=use_cuda)
+        self._hist_buf = torch.zeros(1, MAX_HISTORY, 4, pin_memory=use_cuda)
+        self._copy_stream = torch.cuda.Stream() if use_cuda else None
+        self._copy_done = torch.cuda.Event() if use_cuda else None
+        if use_cuda and self._graph is not None:
+            self._d_planes, self._d_hist = self._g_planes, self._g_hist
+        elif use_cuda:
+            self._d_planes = torch.zeros_like(self._planes_buf, device=self.device)
+            self._d_planes = self._d_planes.contiguous(memory_format=self._memory_format)
+            self._d_hist = torch.zeros_like(self._hist_buf, device=self.device)
 
     # ---------- Game control ----------
 
@@ -332,108 +567,301 @@ class NeuralChessEngine:
         self.history = []
         self.state = BrainState(ca_state=torch.zeros(1, 4, 8, 8, device=self.device))
 
+    # ---------- Legal move cache ----------
+
+    def _get_legal_cache(self) -> LegalEntry:
+        key = self.board._transposition_key()
+        entry = self._legal_cache.get(key)
+        if entry is not None:
+            self._legal_cache.move_to_end(key)
+            return entry
+        moves = list(self.board.legal_moves)
+        entry = (moves, legal_move_lookup(moves), encode_moves_to_indices(moves))
+        self._legal_cache[key] = entry
+        if len(self._legal_cache) > LEGAL_CACHE_SIZE:
+            self._legal_cache.popitem(last=False)
+        return entry
+
+    def index_to_move(self, idx: int) -> Optional[chess.Move]:
+        """
+        Map a policy index back to a legal move on self.board (if any).
+        """
+        _, lookup, _ = self._get_legal_cache()
+        return lookup.get(divmod(idx, 64))
+
     # ---------- Neural forward helpers ----------
 
+    def _autocast(self, cache_enabled: bool = True) -> torch.autocast:
+        return torch.autocast(device_type=self.device.type, dtype=self._amp_dtype,
+                              enabled=self._amp_enabled, cache_enabled=cache_enabled)
+
+    def _warmup(self) -> None:
+        """
+        Compile the calls that play and training actually make up front,
+        rather than on the first move and first batch:
+          - the eager select_move brain forward (a captured CUDA graph has
+            already compiled it during capture)
+          - the train_on_batch forwards, with batch size and history length
+            marked dynamic so later batches reuse the same graphs
+        """
+        if self._graph is None:
+            planes = torch.zeros(1, NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE, device=self.device)
+            planes = planes.contiguous(memory_format=self._memory_format)
+            hist_buf = torch.zeros(1, MAX_HISTORY, 4, device=self.device)
+            with torch.inference_mode(), self._autocast():
+                # A fresh game (T=1), then any longer history.
+                for T in (1, 2):
+                    self.brain(planes, hist_buf[:, :T], self.state.ca_state)
+
+        N, T = 2, 2
+        planes = torch.zeros(N, NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE, device=self.device)
+        planes = planes.contiguous(memory_format=self._memory_format)
+        hist_seq = torch.zeros(N, T, 4, device=self.device)
+        hist_len = torch.full((N,), T, dtype=torch.long, device=self.device)
+        ca_state = torch.zeros(N, 4, BOARD_SIZE, BOARD_SIZE, device=self.device)
+        move_idx = torch.zeros(N, dtype=torch.long, device=self.device)
+        for t in (planes, hist_seq, hist_len, ca_state, move_idx):
+            torch._dynamo.maybe_mark_dynamic(t, 0)
+        torch._dynamo.maybe_mark_dynamic(hist_seq, 1)
+        # Same calls as _train_step, without the backward passes.
+        with self._autocast():
+            board_feat = self.board_cnn(planes)
+            disc_feat = board_feat.detach()
+            torch._dynamo.maybe_mark_dynamic(disc_feat, 0)
+            self.disc(planes, move_idx, board_feat=disc_feat)
+            self.brain(planes, hist_seq, ca_state, hist_len, board_feat=board_feat)
+
+    def _capture_brain_graph(self) -> None:
+        """
+        Capture the batch=1 brain forward as a CUDA graph over static buffers.
+        History is right-padded to MAX_HISTORY and masked by its valid length.
+        Optimizer steps update weights in place, so replays see trained weights.
+        """
+        self._g_planes = torch.zeros(1, NUM_PIECE_PLANES, BOARD_SIZE, BOARD_SIZE, device=self.device)
+        self._g_planes = self._g_planes.contiguous(memory_format=self._memory_format)
+        self._g_hist = torch.zeros(1, MAX_HISTORY, 4, device=self.device)
+        self._g_hist_len = torch.ones(1, dtype=torch.long, device=self.device)
+        self._g_ca = torch.zeros(1, 4, BOARD_SIZE, BOARD_SIZE, device=self.device)
+        args = (self._g_planes, self._g_hist, self._g_ca, self._g_hist_len)
+
+        try:
+            # Warm up on a side stream (cudnn.benchmark autotuning, lazy init).
+            side = torch.cuda.Stream()
+            side.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(side), torch.no_grad(), self._autocast(cache_enabled=False):
+                for _ in range(2):
+                    self.brain(*args)
+            torch.cuda.current_stream().wait_stream(side)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph), torch.no_grad(), self._autocast(cache_enabled=False):
+                self._g_logits, self._g_value, self._g_new_ca = self.brain(*args)
+            self._graph = graph
+        except RuntimeError as exc:
+            print(f"[engine] CUDA graph capture failed, using eager inference: {exc}")
+            self._graph = None
+
+    def _infer_brain(self,
+                     planes: torch.Tensor,
+                     hist_seq: torch.Tensor,
+                     ca_state: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Inference-only brain forward; uses the TensorRT engine or replays the
+        captured CUDA graph if either is available.
+        """
+        if self._trt is not None:
+            return self._trt(planes, hist_seq, ca_state)
+        if self._graph is None:
+            with torch.inference_mode(), self._autocast():
+                return self.brain(planes, hist_seq, ca_state)
+
+        # _prepare_inputs stages straight into the static inputs; copy only
+        # when called with other tensors.
+        T = hist_seq.size(1)
+        if planes.data_ptr() != self._g_planes.data_ptr():
+            self._g_planes.copy_(planes, non_blocking=True)
+        if hist_seq.data_ptr() != self._g_hist.data_ptr():
+            self._g_hist.zero_()
+            self._g_hist[:, :T].copy_(hist_seq, non_blocking=True)
+        self._g_hist_len.fill_(T)
+        self._g_ca.copy_(ca_state, non_blocking=True)
+        self._graph.replay()
+        # Outputs live in graph-owned memory that the next replay overwrites.
+        return self._g_logits.clone(), self._g_value.clone(), self._g_new_ca.clone()
+
     def _prepare_inputs(self) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-        planes = board_to_planes(self.board).unsqueeze(0).to(self.device)  # [1,12,8,8]
-        hist_seq = encode_history(self.history).unsqueeze(0).to(self.device)  # [1,T,4]
+        # Don't overwrite pinned buffers while the previous copy may still
+        # read them (normally long finished by the last move's .item()).
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+        board_to_planes(self.board, out=self._planes_buf[0].numpy())
+        T = encode_history(self.history, out=self._hist_buf[0].numpy()).size(0)
         ca_state = self.state.ca_state
-        return planes, hist_seq, ca_state
+        if self._copy_stream is None:
+            return self._planes_buf, self._hist_buf[:, :T], ca_state
+
+        # Right-pad so the device buffer can feed the CUDA graph as-is.
+        self._hist_buf[:, T:] = 0.0
+        compute = torch.cuda.current_stream()
+        # Single wait: earlier kernels reading the device buffers are done.
+        self._copy_stream.wait_stream(compute)
+        with torch.cuda.stream(self._copy_stream):
+            self._d_planes.copy_(self._planes_buf, non_blocking=True)
+            self._d_hist.copy_(self._hist_buf, non_blocking=True)
+            self._copy_done.record()
+        compute.wait_event(self._copy_done)
+        return self._d_planes, self._d_hist[:, :T], ca_state  # [1,12,8,8], [1,T,4]
 
     # ---------- Move selection ----------
 
-    def select_move(self, temperature: float = 1.0) -> Optional[chess.Move]:
+    def select_move(self,
+                    temperature: float = 1.0,
+                    legal_moves: Optional[List[chess.Move]] = None) -> Optional[chess.Move]:
         if self.board.is_game_over():
             return None
 
-        legal_moves = list(self.board.legal_moves)
+        cached_moves, _, cached_indices = self._get_legal_cache()
+        if legal_moves is None or legal_moves is cached_moves:
+            legal_moves, legal_indices = cached_moves, cached_indices
+        else:
+            legal_indices = encode_moves_to_indices(legal_moves)
         if not legal_moves:
             return None
 
         planes, hist_seq, ca_state = self._prepare_inputs()
-        with torch.no_grad():
-            policy_logits, _, new_ca = self.brain(planes, hist_seq, ca_state)
-        self.state.ca_state = new_ca.detach()
+        policy_logits, _, new_ca = self._infer_brain(planes, hist_seq, ca_state)
+        # Clone out of inference mode: train_on_position feeds this to autograd.
+        self.state.ca_state = new_ca.clone()
 
-        logits = policy_logits[0]  # [4096]
+        logits = policy_logits[0].float()  # [4096]
         # Mask illegal moves
-        mask = torch.full_like(logits, float("-inf"))
-        legal_indices = []
-        for mv in legal_moves:
-            idx = encode_move_to_index(mv)
-            legal_indices.append(idx)
-        legal_indices_tensor = torch.tensor(legal_indices, device=logits.device, dtype=torch.long)
-        mask[legal_indices_tensor] = logits[legal_indices_tensor]
+        legal_indices_tensor = torch.as_tensor(legal_indices, device=logits.device)
+        self._legal_mask.zero_().scatter_(0, legal_indices_tensor, True)
+        masked = logits.masked_fill(~self._legal_mask, float("-inf"))
 
         if temperature <= 0.0:
             # Greedy
-            best_idx = torch.argmax(mask).item()
-            move = index_to_move(self.board, best_idx)
+            best_idx = torch.argmax(masked).item()
+            move = self.index_to_move(best_idx)
             return move
 
-        # Softmax with temperature over legal moves
-        masked_vals = mask[legal_indices_tensor] / max(temperature, 1e-3)
-        probs = torch.softmax(masked_vals, dim=0)
-        choice = torch.multinomial(probs, num_samples=1).item()
-        chosen_idx = legal_indices[choice]
-        return index_to_move(self.board, chosen_idx)
+        # Sample from softmax(masked / T) via Gumbel-max; illegal moves stay -inf
+        gumbel = -torch.log(-torch.log(torch.rand_like(masked)))
+        chosen_idx = torch.argmax(masked / max(temperature, 1e-3) + gumbel).item()
+        return self.index_to_move(chosen_idx)
 
     # ---------- Training step (simple GAN-ish) ----------
 
-    def train_on_position(self,
-                          real_move: chess.Move,
-                          fake_move: chess.Move) -> None:
+    def _train_step(self,
+                    planes: torch.Tensor,
+                    hist_seq: torch.Tensor,
+                    ca_state: torch.Tensor,
+                    hist_len: Optional[torch.Tensor],
+                    real_idx: torch.Tensor,
+                    fake_idx: torch.Tensor) -> None:
         """
-        Train discriminator and generator a bit on:
-          - real_move: treated as plausible
-          - fake_move: treated as implausible
+        One discriminator and one generator step on a batch:
+          - real_idx: moves treated as plausible (and the policy target)
+          - fake_idx: moves treated as implausible
         """
-        self.gen_opt.zero_grad()
-        self.disc_opt.zero_grad()
+        if self._trt is not None:
+            raise RuntimeError("Cannot train with a TensorRT engine: select_move would keep "
+                               "playing the frozen plan, not the weights being trained.")
 
-        planes = board_to_planes(self.board).unsqueeze(0).to(self.device)  # [1,12,8,8]
-        real_idx = torch.tensor([encode_move_to_index(real_move)], device=self.device, dtype=torch.long)
-        fake_idx = torch.tensor([encode_move_to_index(fake_move)], device=self.device, dtype=torch.long)
+        # Shared board features, computed once for both nets
+        with self._autocast():
+            board_feat = self.board_cnn(planes)
 
         # --- Train discriminator ---
-        real_score = self.disc(planes, real_idx)
-        fake_score = self.disc(planes, fake_idx)
-
-        real_target = torch.ones_like(real_score)
-        fake_target = torch.zeros_like(fake_score)
-
-        disc_loss = self.bce(real_score, real_target) + self.bce(fake_score, fake_target)
-        disc_loss.backward(retain_graph=True)
-        self.disc_opt.step()
-
-        # --- Train generator (policy) to like real move ---
+        # Detached features keep the disc graph separate from the generator's,
+        # so neither backward needs to retain the other's graph.
+        self.disc_opt.zero_grad()
+        with self._autocast():
+            real_score = self.disc(planes, real_idx, board_feat=board_feat.detach())
+            fake_score = self.disc(planes, fake_idx, board_feat=board_feat.detach())
+        # Compute the loss on fp32 logits.
+        real_score = real_score.float()
+        fake_score = fake_score.float()
+        disc_loss = self.bce(real_score, torch.ones_like(real_score)) + \
+            self.bce(fake_score, torch.zeros_like(fake_score))
+        self.scaler.scale(disc_loss).backward()
+        self.scaler.step(self.disc_opt)
+
+        # --- Train generator (policy) to like real moves ---
         self.gen_opt.zero_grad()
+        with self._autocast():
+            policy_logits, _, _ = self.brain(planes, hist_seq, ca_state, hist_len, board_feat=board_feat)
+        # Negative log-prob of real move index (softmax over all)
+        gen_loss = nn.functional.cross_entropy(policy_logits.float(), real_idx)
+        self.scaler.scale(gen_loss).backward()
+        self.scaler.step(self.gen_opt)
 
-        planes_g, hist_seq_g, ca_state_g = self._prepare_inputs()
-        policy_logits, _, _ = self.brain(planes_g, hist_seq_g, ca_state_g)
-        logits = policy_logits[0]  # [4096]
+        # One scale update per iteration, after every optimizer has stepped.
+        self.scaler.update()
 
-        # Negative log-prob of real_move index (softmax over all)
-        log_probs = torch.log_softmax(logits, dim=0)
-        gen_loss = -log_probs[real_idx[0]]
+    def train_on_position(self,
+                          real_move: chess.Move,
+                          fake_move: chess.Move) -> None:
+        """
+        Train discriminator and generator a bit on the current position:
+          - real_move: treated as plausible
+          - fake_move: treated as implausible
+        """
+        planes, hist_seq, ca_state = self._prepare_inputs()
+        real_idx = self._idx_buf_real.fill_(encode_move_to_index(real_move))
+        fake_idx = self._idx_buf_fake.fill_(encode_move_to_index(fake_move))
+        self._train_step(planes, hist_seq, ca_state, None, real_idx, fake_idx)
 
-        gen_loss.backward()
-        self.gen_opt.step()
+    def record_position(self,
+                        real_move: chess.Move,
+                        fake_move: chess.Move) -> None:
+        """
+        Queue the current position as a training example for train_on_batch.
+        """
+        self._replay.append((
+            board_to_planes(self.board).numpy(),
+            encode_history(self.history).numpy(),
+            self.state.ca_state[0].float().cpu().numpy(),
+            encode_move_to_index(real_move),
+            encode_move_to_index(fake_move),
+        ))
+
+    def train_on_batch(self, batch_size: int = 64) -> None:
+        """
+        Pop up to batch_size queued positions and run one discriminator and
+        one generator step on them as a single batch.
+        """
+        if not self._replay:
+            return
+        batch = self._replay[:batch_size]
+        del self._replay[:batch_size]
+        planes_np, hist_np, ca_np, real_np, fake_np = zip(*batch)
+
+        planes = torch.from_numpy(np.stack(planes_np)).to(self.device, non_blocking=True)
+        planes = planes.contiguous(memory_format=self._memory_format)  # [N,12,8,8]
+        hist_seq = pad_sequence([torch.from_numpy(h) for h in hist_np],
+                                batch_first=True).to(self.device, non_blocking=True)  # [N,T,4]
+        hist_len = torch.tensor([len(h) for h in hist_np], dtype=torch.long, device=self.device)
+        ca_state = torch.from_numpy(np.stack(ca_np)).to(self.device, non_blocking=True)  # [N,C,8,8]
+        real_idx = torch.as_tensor(np.array(real_np, dtype=np.int64)).to(self.device, non_blocking=True)
+        fake_idx = torch.as_tensor(np.array(fake_np, dtype=np.int64)).to(self.device, non_blocking=True)
+
+        self._train_step(planes, hist_seq, ca_state, hist_len, real_idx, fake_idx)
 
     # ---------- Self-play training ----------
 
-    def self_play_game(self, max_moves: int = 200) -> None:
+    def self_play_game(self, max_moves: int = 200, batch_size: int = 64) -> None:
         self.reset_game()
         for _ply in range(max_moves):
             if self.board.is_game_over():
                 break
 
-            legal_moves = list(self.board.legal_moves)
+            legal_moves, _, _ = self._get_legal_cache()
             if not legal_moves:
                 break
 
             # True "real" move: let current policy pick
-            real_move = self.select_move(temperature=0.7)
+            real_move = self.select_move(temperature=0.7, legal_moves=legal_moves)
             if real_move is None:
                 break
 
@@ -444,17 +872,22 @@ class NeuralChessEngine:
             else:
                 fake_move = random.choice(fake_candidates)
 
-            # Train a little at this position
-            self.train_on_position(real_move=real_move, fake_move=fake_move)
+            # Queue this position; train once a full batch is available
+            self.record_position(real_move=real_move, fake_move=fake_move)
+            if len(self._replay) >= batch_size:
+                self.train_on_batch(batch_size=batch_size)
 
             # Play the real move on board and append to history
             self.board.push(real_move)
             self.history.append(real_move)
 
-    def train_self_play(self, games: int = 10, max_moves: int = 200) -> None:
+        # Flush the tail of the game
+        self.train_on_batch(batch_size=batch_size)
+
+    def train_self_play(self, games: int = 10, max_moves: int = 200, batch_size: int = 64) -> None:
         for g in range(1, games + 1):
             print(f"[train] Self-play game {g}/{games}")
-            self.self_play_game(max_moves=max_moves)
+            self.self_play_game(max_moves=max_moves, batch_size=batch_size)
             print(f"[train] Game {g} result: {self.board.result(claim_draw=True)}")
 
     # ---------- Human vs AI ----------
@@ -519,6 +952,17 @@ def main() -> None:
                         type=int,
                         default=200,
                         help="Max half-moves per self-play game.")
+    parser.add_argument("--batch-size",
+                        type=int,
+                        default=64,
+                        help="Positions per training batch in self-play mode.")
+    parser.add_argument("--no-compile",
+                        action="store_true",
+                        help="Run the networks eagerly instead of via torch.compile (debugging).")
+    parser.add_argument("--engine",
+                        default=None,
+                        help="TensorRT plan from export_trt.py to run move selection "
+                             "(human mode, CUDA only).")
     parser.add_argument("--human-plays-white",
                         action="store_true",
                         help="In human mode, human plays White (default).")
@@ -527,6 +971,8 @@ def main() -> None:
                         help="In human mode, human plays Black.")
 
     args = parser.parse_args()
+    if args.engine and args.mode != "human":
+        parser.error("--engine serves frozen TensorRT weights; it is only valid with --mode human")
 
     human_white = True
     if args.human_plays_black:
@@ -534,12 +980,12 @@ def main() -> None:
     if args.human_plays_white:
         human_white = True
 
-    engine = NeuralChessEngine()
+    engine = NeuralChessEngine(compile_models=not args.no_compile, engine_path=args.engine)
 
     if args.mode == "human":
         engine.play_vs_human(human_plays_white=human_white)
     else:
-        engine.train_self_play(games=args.games, max_moves=args.max_moves)
+        engine.train_self_play(games=args.games, max_moves=args.max_moves, batch_size=args.batch_size)
 
 
 if __name__ == "__main__":